@@ -1,23 +1,86 @@
 """Visualize Tracking Data."""
+import importlib
+import sys
+from types import ModuleType
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import TYPE_CHECKING
+
 from .__main__ import main
-from .heatmap import heatmap
-from .heatmap import heatmap_from_dataframe
-from .input_file import gpx_to_dataframe
-from .input_file import tcx_to_dataframe
-from .input_file import TrackingColumn
-from .speed import plot_acceleration
-from .speed import plot_movement_field
-from .speed import plot_speed
-from .speed import plot_speed_moving_avg
-from .speed import track_2_movements
-from .speed import web_plot_speed_climb_kde
-from .speed import web_plot_speed_elevation
-from .webserver import run_webserver
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .heatmap import heatmap
+    from .heatmap import heatmap_from_dataframe
+    from .input_file import csv_to_dataframe
+    from .input_file import gpx_to_dataframe
+    from .input_file import tcx_to_dataframe
+    from .input_file import TrackingColumn
+    from .speed import plot_acceleration
+    from .speed import plot_movement_field
+    from .speed import plot_speed
+    from .speed import plot_speed_moving_avg
+    from .speed import track_2_movements
+    from .speed import web_plot_speed_climb_kde
+    from .speed import web_plot_speed_elevation
+    from .webserver import run_webserver
+
+# Public name => submodule defining it.
+# Imported on first access, so that the CLI does not pay for pandas / matplotlib / flask.
+_LAZY_ATTRIBUTES: Dict[str, str] = {
+    "heatmap": ".heatmap",
+    "heatmap_from_dataframe": ".heatmap",
+    "csv_to_dataframe": ".input_file",
+    "gpx_to_dataframe": ".input_file",
+    "tcx_to_dataframe": ".input_file",
+    "TrackingColumn": ".input_file",
+    "plot_acceleration": ".speed",
+    "plot_movement_field": ".speed",
+    "plot_speed": ".speed",
+    "plot_speed_moving_avg": ".speed",
+    "track_2_movements": ".speed",
+    "web_plot_speed_climb_kde": ".speed",
+    "web_plot_speed_elevation": ".speed",
+    "run_webserver": ".webserver",
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Import the public functions on first access (PEP 562)."""
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    """List the public functions before they are imported (e.g. for autodoc)."""
+    return sorted({*globals(), *_LAZY_ATTRIBUTES})
+
+
+class _LazyPackage(ModuleType):
+    """Package module whose public functions are not shadowed by submodules.
+
+    Importing ``track_viz.heatmap`` binds the submodule as attribute ``heatmap`` of the package,
+    which would hide the function of the same name.
+    """
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if isinstance(value, ModuleType) and name in _LAZY_ATTRIBUTES:
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
+
 
 __all__ = [
     "main",
     "heatmap",
     "heatmap_from_dataframe",
+    "csv_to_dataframe",
     "gpx_to_dataframe",
     "tcx_to_dataframe",
     "TrackingColumn",
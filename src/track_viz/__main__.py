@@ -1,131 +1,80 @@
 """Command-line interface."""
-from pathlib import Path
-from typing import Any
+import importlib
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
 
 import click
 
-from .heatmap import heatmap as do_heatmap
-from .input_file import gpx_to_dataframe
-from .input_file import tcx_to_dataframe
-from .speed import plot_speed
-from .speed import plot_speed_moving_avg
-from .webserver import run_webserver
 
+class LazyGroup(click.Group):
+    """Group whose subcommands are imported only when they are invoked.
 
-@click.group()
+    The implementation modules pull in pandas, matplotlib, seaborn, flask...
+    Keeping them out of the import path makes ``--help`` and ``--version`` instant.
+    """
+
+    # Command name => (module, attribute, short help shown by --help)
+    lazy_subcommands: Dict[str, Tuple[str, str, str]] = {
+        "tcx-to-csv": (
+            "track_viz.input_file",
+            "tcx_to_csv_cmd",
+            "TCX file to CSV dataframe.",
+        ),
+        "gpx-to-csv": (
+            "track_viz.input_file",
+            "gpx_to_csv_cmd",
+            "GPX file to CSV dataframe.",
+        ),
+        "speed": ("track_viz.speed", "speed_cmd", "CVS dataframe to Speed plot."),
+        "speed-moving": (
+            "track_viz.speed",
+            "speed_moving_cmd",
+            "CVS dataframe to Speed plot.",
+        ),
+        "heatmap": ("track_viz.heatmap", "heatmap_cmd", "CSV dataframe to heatmap."),
+        "flask": ("track_viz.webserver", "flask_cmd", "Have a web server GUI."),
+    }
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        """Names of the eager and lazy subcommands."""
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        """Import the subcommand on first use."""
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
+
+        module_name, attr, _ = self.lazy_subcommands[cmd_name]
+        command: click.Command = getattr(importlib.import_module(module_name), attr)
+        return command
+
+    def format_commands(
+        self, ctx: click.Context, formatter: click.HelpFormatter
+    ) -> None:
+        """List the subcommands without importing the lazy ones.
+
+        click.Group would load every command to get its short help.
+        """
+        short_helps = {
+            name: short_help
+            for name, (_, _, short_help) in self.lazy_subcommands.items()
+        }
+        # Commands registered with @main.command() are already loaded
+        for name in super().list_commands(ctx):
+            command = super().get_command(ctx, name)
+            if command is not None and not command.hidden:
+                short_helps[name] = command.get_short_help_str()
+        with formatter.section("Commands"):
+            formatter.write_dl(sorted(short_helps.items()))
+
+
+@click.group(cls=LazyGroup)
 @click.version_option()
 def main() -> None:
     """Visualize Tracking Data."""
 
 
-@main.command()
-@click.option(
-    "--tcx",
-    type=click.Path(
-        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
-    ),
-)
-@click.option(
-    "--to",
-    type=click.Path(
-        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
-    ),
-)
-def tcx_to_csv(**kwargs: Any) -> None:
-    """TCX file to CSV dataframe."""
-    to = kwargs.pop("to")
-    df = tcx_to_dataframe(**kwargs)
-    df.to_csv(to, index=False)
-
-
-@main.command()
-@click.option(
-    "--gpx",
-    type=click.Path(
-        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
-    ),
-)
-@click.option(
-    "--to",
-    type=click.Path(
-        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
-    ),
-)
-def gpx_to_csv(**kwargs: Any) -> None:
-    """GPX file to CSV dataframe."""
-    to = kwargs.pop("to")
-    df = gpx_to_dataframe(**kwargs)
-    df.to_csv(to, index=False)
-
-
-@main.command()
-@click.option(
-    "--track",
-    type=click.Path(
-        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
-    ),
-)
-@click.option(
-    "--img",
-    type=click.Path(
-        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
-    ),
-)
-def speed(track: Path, img: Path) -> None:
-    """CVS dataframe to Speed plot."""
-    fig = plot_speed(track=track)
-    fig.savefig(img)
-
-
-@main.command()
-@click.option(
-    "--track",
-    type=click.Path(
-        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
-    ),
-)
-@click.option(
-    "--img",
-    type=click.Path(
-        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
-    ),
-)
-def speed_moving(track: Path, img: Path) -> None:
-    """CVS dataframe to Speed plot."""
-    fig = plot_speed_moving_avg(track=track)
-    fig.savefig(img)
-
-
-@main.command()
-@click.option(
-    "--track",
-    type=click.Path(
-        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
-    ),
-)
-@click.option(
-    "--img",
-    type=click.Path(
-        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
-    ),
-)
-def heatmap(track: Path, img: Path) -> None:
-    """CSV dataframe to heatmap.
-
-    Uses mapbox (https://mapbox.com). Create an account and get a TOKEN.
-    Needs the environment variable MAPBOX_TOKEN to contain a valid Mapbox TOKEN.
-    """
-    fig = do_heatmap(track=track)
-    fig.savefig(img)
-
-
-@main.command()
-@click.option("--host", type=str, default="127.0.0.1")
-@click.option("--port", type=int, default=5000)
-def flask(**kwargs: Any) -> None:
-    """Have a web server GUI."""
-    run_webserver(**kwargs)
-
-
 if __name__ == "__main__":
     main(prog_name="track-viz")  # pragma: no cover
@@ -2,6 +2,8 @@
 import datetime as dt
 import os
 from dataclasses import dataclass
+from functools import lru_cache
+from hashlib import blake2b
 from io import BytesIO
 from math import atan
 from math import exp
@@ -11,17 +13,24 @@ from math import log2
 from math import pi
 from math import tan
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 from typing import Any
 from typing import Dict
+from typing import Optional
 from typing import Protocol
 from typing import Tuple
 from urllib.request import urlopen
 
+import click
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import seaborn as sns
+from matplotlib.figure import Figure
 
+from .input_file import csv_to_dataframe
 from .input_file import TrackingColumn
 from .speed import track_2_movements
 
@@ -159,6 +168,130 @@ def _get_map_by_bbox(bbox: BBox) -> Tuple[Dict[str, Any], BBox]:
     raise ValueError("Does not compute")
 
 
+# The image behind a given URL never changes, keep it for the other processes and the next runs
+# Set MAPBOX_CACHE_DIR to move the cache, by default it is private to the user
+MAPBOX_CACHE_DIR = Path(
+    os.getenv("MAPBOX_CACHE_DIR", Path.home() / ".cache" / "track-viz" / "mapbox")
+)
+# Least recently used images are removed beyond this count (about 1 MB each)
+MAPBOX_CACHE_SIZE = 64
+
+
+def _cached_background(mapbox_url: str) -> Path:
+    key = blake2b(mapbox_url.encode("utf-8"), digest_size=16).hexdigest()
+    return MAPBOX_CACHE_DIR / f"{key}.jpg"
+
+
+def _download_background(mapbox_url: str, refresh: bool = False) -> bytes:
+    cached = _cached_background(mapbox_url)
+    if cached.exists() and not refresh:
+        # Most recently used files are kept
+        cached.touch()
+        return cached.read_bytes()
+
+    with urlopen(mapbox_url) as api_call:  # noqa
+        data: bytes = api_call.read()
+
+    # Write then rename, so that a concurrent reader never sees a partial file (unique per call)
+    MAPBOX_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with NamedTemporaryFile(
+        dir=MAPBOX_CACHE_DIR, suffix=".part", delete=False
+    ) as partial:
+        partial.write(data)
+    Path(partial.name).replace(cached)
+
+    images = sorted(
+        MAPBOX_CACHE_DIR.glob("*.jpg"), key=lambda f: f.stat().st_mtime, reverse=True
+    )
+    for image in images[MAPBOX_CACHE_SIZE:]:
+        image.unlink(missing_ok=True)
+    return data
+
+
+# The parameters are snapped in _get_map_by_bbox, so that tracks on the same field share the same URL
+# Each entry is a decoded 2048x2048 RGB image (12.6 MB), the disk cache covers the other URLs
+@lru_cache(maxsize=2)
+def _load_background(mapbox_url: str) -> npt.NDArray[np.uint8]:
+    from_cache = _cached_background(mapbox_url).exists()
+    data = _download_background(mapbox_url)
+    try:
+        img_data: npt.NDArray[np.uint8] = plt.imread(BytesIO(data), format="jpg")
+    except (OSError, ValueError):
+        # Only a cached file is downloaded again, it may have been damaged on disk
+        if not from_cache:
+            raise
+        img_data = plt.imread(
+            BytesIO(_download_background(mapbox_url, refresh=True)), format="jpg"
+        )
+    # Shared between calls
+    img_data.setflags(write=False)
+    return img_data
+
+
+# Gaussian KDE evaluated like seaborn's kdeplot (Scott's bandwidth, grid, iso-proportion levels),
+# but on a 2D histogram of the points instead of summing one kernel per point for every grid cell
+KDE_GRIDSIZE = 200
+KDE_CUT = 3
+KDE_THRESH = 0.05
+
+
+def _binned_kde(
+    x: npt.NDArray[np.float64], y: npt.NDArray[np.float64]
+) -> Optional[
+    Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64], npt.NDArray[np.float64]]
+]:
+    # Points without a position are left out, like seaborn does
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+    # No density when the points do not spread over a surface (seaborn only warns and skips it)
+    if len(x) < 2:
+        return None
+    # Scott's rule, applied to the full covariance as in scipy's gaussian_kde
+    covariance = np.cov(x, y) * len(x) ** (-1 / 3)
+    if np.linalg.matrix_rank(covariance) < 2:
+        return None
+    bandwidths = np.sqrt(np.diag(covariance))
+    edges = [
+        np.linspace(v.min() - KDE_CUT * bw, v.max() + KDE_CUT * bw, KDE_GRIDSIZE + 1)
+        for v, bw in zip((x, y), bandwidths)
+    ]
+    hist, _, _ = np.histogram2d(x, y, bins=edges)
+
+    # Gaussian kernel for every offset between 2 grid cells
+    offsets = np.arange(1 - KDE_GRIDSIZE, KDE_GRIDSIZE)
+    dx, dy = np.meshgrid(
+        offsets * (edges[0][1] - edges[0][0]),
+        offsets * (edges[1][1] - edges[1][0]),
+        indexing="ij",
+    )
+    inv = np.linalg.inv(covariance)
+    kernel = np.exp(
+        -0.5 * (inv[0, 0] * dx**2 + 2 * inv[0, 1] * dx * dy + inv[1, 1] * dy**2)
+    )
+
+    # Convolve the histogram with the kernel, through FFT
+    shape = (3 * KDE_GRIDSIZE - 2,) * 2
+    full = np.fft.irfft2(np.fft.rfft2(hist, shape) * np.fft.rfft2(kernel, shape), shape)
+    window = slice(KDE_GRIDSIZE - 1, 2 * KDE_GRIDSIZE - 1)
+    density: npt.NDArray[np.float64] = full[window, window]
+
+    centers = [(e[:-1] + e[1:]) / 2 for e in edges]
+    return centers[0], centers[1], density
+
+
+def _iso_proportion_levels(
+    density: npt.NDArray[np.float64], n_levels: int
+) -> npt.NDArray[np.float64]:
+    # Density values enclosing 95% ... 0% of the mass
+    sorted_values = np.sort(density.ravel())[::-1]
+    cumulated = np.cumsum(sorted_values) / sorted_values.sum()
+    idx = np.searchsorted(cumulated, 1 - np.linspace(KDE_THRESH, 1, n_levels))
+    levels: npt.NDArray[np.float64] = np.unique(
+        np.take(sorted_values, idx, mode="clip")
+    )
+    return levels
+
+
 def heatmap_from_dataframe(track: pd.DataFrame) -> mpl.figure.Figure:
     """Create heatmap."""
     # Find the bounding box from all point coordinates
@@ -175,11 +308,7 @@ def heatmap_from_dataframe(track: pd.DataFrame) -> mpl.figure.Figure:
 
     # Get data from mapbox
     url_template = "https://api.mapbox.com/styles/v1/mapbox/{style}/static/{lon},{lat},{zoom}/{w}x{h}{retina}?access_token={token}&attribution=false&logo=false"  # noqa
-    mapbox_url = url_template.format(**params)
-    with urlopen(mapbox_url) as api_call:  # noqa
-        data = api_call.read()
-
-    img_data = plt.imread(BytesIO(data), format="jpg")
+    img_data = _load_background(url_template.format(**params))
 
     left, bottom, right, top = (
         final_bbox.southwest.lon,
@@ -187,11 +316,11 @@ def heatmap_from_dataframe(track: pd.DataFrame) -> mpl.figure.Figure:
         final_bbox.northeast.lon,
         final_bbox.northeast.lat,
     )
-    track["lon_x"] = track[TrackingColumn.LONGITUDE].apply(
-        lambda x: img_data.shape[0] * (x - left) / (right - left)
+    track["lon_x"] = (track[TrackingColumn.LONGITUDE].to_numpy() - left) * (
+        img_data.shape[0] / (right - left)
     )
-    track["lat_y"] = track[TrackingColumn.LATITUDE].apply(
-        lambda y: img_data.shape[1] * (y - bottom) / (top - bottom)
+    track["lat_y"] = (track[TrackingColumn.LATITUDE].to_numpy() - bottom) * (
+        img_data.shape[1] / (top - bottom)
     )
 
     movs = track_2_movements(track)
@@ -201,18 +330,20 @@ def heatmap_from_dataframe(track: pd.DataFrame) -> mpl.figure.Figure:
         track[TrackingColumn.TIME].max() - track[TrackingColumn.TIME].min()
     ).total_seconds()
 
-    fig, ax = plt.subplots(figsize=(10, 10))
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots()
 
     # Draw the heatmap
-    sns.kdeplot(
-        data=track,
-        x="lon_x",
-        y="lat_y",
-        levels=100,
-        fill=True,
-        cmap="rocket_r",
-        ax=ax,
-    )
+    kde = _binned_kde(track["lon_x"].to_numpy(), track["lat_y"].to_numpy())
+    if kde is not None:
+        x_centers, y_centers, density = kde
+        ax.contourf(
+            x_centers,
+            y_centers,
+            density.T,
+            levels=_iso_proportion_levels(density, n_levels=100),
+            cmap=sns.color_palette("rocket_r", as_cmap=True),
+        )
 
     # Draw the satellite image
     ax.imshow(img_data, extent=[0, img_data.shape[0], 0, img_data.shape[1]])
@@ -252,5 +383,28 @@ def heatmap_from_dataframe(track: pd.DataFrame) -> mpl.figure.Figure:
 
 def heatmap(track: Path) -> mpl.figure.Figure:
     """Create heatmap."""
-    df = pd.read_csv(track, parse_dates=["time"])
+    df = csv_to_dataframe(track)
     return heatmap_from_dataframe(track=df)
+
+
+@click.command(name="heatmap")
+@click.option(
+    "--track",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
+    ),
+)
+@click.option(
+    "--img",
+    type=click.Path(
+        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
+    ),
+)
+def heatmap_cmd(track: Path, img: Path) -> None:
+    """CSV dataframe to heatmap.
+
+    Uses mapbox (https://mapbox.com). Create an account and get a TOKEN.
+    Needs the environment variable MAPBOX_TOKEN to contain a valid Mapbox TOKEN.
+    """
+    fig = heatmap(track=track)
+    fig.savefig(img)
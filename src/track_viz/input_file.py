@@ -1,13 +1,17 @@
 """Process a TCX or GPX file into a dataframe."""
+import re
 from pathlib import Path
 from typing import Any
 from typing import Dict
+from typing import IO
 from typing import List
 from typing import Optional
+from typing import Union
 
+import click
 import numpy as np
 import pandas as pd
-from defusedxml.ElementTree import parse
+from defusedxml.ElementTree import iterparse
 
 
 class TrackingColumn:
@@ -20,6 +24,29 @@ class TrackingColumn:
     HEARTBEAT = "bpm"
 
 
+# A file on disk, or an opened one (e.g. an upload)
+TrackSource = Union[Path, IO[bytes]]
+
+# Qualified names of the elements read from the files
+_TCX_NS = "{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}"
+_TCX_TRACKPOINT = f"{_TCX_NS}Trackpoint"
+_TCX_TIME = f"{_TCX_NS}Time"
+_TCX_POSITION = f"{_TCX_NS}Position"
+_TCX_LATITUDE = f"{_TCX_NS}LatitudeDegrees"
+_TCX_LONGITUDE = f"{_TCX_NS}LongitudeDegrees"
+_TCX_ALTITUDE = f"{_TCX_NS}AltitudeMeters"
+_TCX_HEARTBEAT = f"{_TCX_NS}HeartRateBpm"
+_TCX_VALUE = f"{_TCX_NS}Value"
+
+_GPX_NS = "{http://www.topografix.com/GPX/1/1}"
+_GPX_TRACKPOINT = f"{_GPX_NS}trkpt"
+_GPX_TIME = f"{_GPX_NS}time"
+_GPX_ALTITUDE = f"{_GPX_NS}ele"
+
+# Suffix of ISO 8601 timestamps in local time
+_UTC_OFFSET = re.compile(r"[+-]\d{2}:\d{2}")
+
+
 def _float(x: Optional[str]) -> float:
     if x is not None:
         return float(x)
@@ -27,56 +54,144 @@ def _float(x: Optional[str]) -> float:
         return np.nan
 
 
-def _data_to_dataframe(data: List[Dict[str, Any]]) -> pd.DataFrame:
-    df = pd.DataFrame(data)
-    df[TrackingColumn.TIME] = pd.to_datetime(df[TrackingColumn.TIME])
+def _to_datetime(times: List[Optional[str]]) -> pd.DatetimeIndex:
+    # pandas parses ISO 8601 fast, unless there is a UTC offset (+01:00): then it creates a tzinfo per value.
+    # A track is recorded with one offset: parse the local times, then apply the offset once.
+    offsets = {t[-6:] if t is not None else None for t in times}
+    if len(offsets) == 1 and _UTC_OFFSET.fullmatch(str(next(iter(offsets)))):
+        local = pd.to_datetime([t[:-6] for t in times if t is not None])
+        return local.tz_localize(pd.Timestamp(times[0]).tz)
+
+    return pd.to_datetime(times)
+
+
+def _data_to_dataframe(columns: Dict[str, Any]) -> pd.DataFrame:
+    columns[TrackingColumn.TIME] = _to_datetime(columns[TrackingColumn.TIME])
+    return pd.DataFrame(columns)
+
+
+def tcx_to_dataframe(tcx: TrackSource) -> pd.DataFrame:
+    """Process a TCX file, given as a path or as a binary stream."""
+    times: List[Optional[str]] = []
+    lats: List[float] = []
+    lons: List[float] = []
+    alts: List[float] = []
+    bpms: List[Optional[int]] = []
+    for _, point in iterparse(tcx):
+        if point.tag != _TCX_TRACKPOINT:
+            continue
+        time: Optional[str] = None
+        lat: Optional[str] = None
+        lon: Optional[str] = None
+        alt: Optional[str] = None
+        bpm: Optional[str] = None
+        # One pass over the children, instead of one search per field
+        for child in point:
+            if child.tag == _TCX_TIME:
+                time = child.text
+            elif child.tag == _TCX_POSITION:
+                lat = child.findtext(_TCX_LATITUDE)
+                lon = child.findtext(_TCX_LONGITUDE)
+            elif child.tag == _TCX_ALTITUDE:
+                alt = child.text
+            elif child.tag == _TCX_HEARTBEAT:
+                bpm = child.findtext(_TCX_VALUE)
+        times.append(time)
+        lats.append(_float(lat))
+        lons.append(_float(lon))
+        alts.append(_float(alt))
+        bpms.append(int(bpm) if bpm is not None else None)
+        # Done with this trackpoint, do not keep it in memory
+        point.clear()
+
+    df = _data_to_dataframe(
+        {
+            TrackingColumn.TIME: times,
+            TrackingColumn.LATITUDE: np.array(lats, dtype=np.float64),
+            TrackingColumn.LONGITUDE: np.array(lons, dtype=np.float64),
+            TrackingColumn.ALTITUDE: np.array(alts, dtype=np.float64),
+            # Watches do not record a heart rate for every trackpoint
+            TrackingColumn.HEARTBEAT: pd.array(bpms, dtype="Int64"),
+        }
+    )
     return df
 
 
-def tcx_to_dataframe(tcx: Path) -> pd.DataFrame:
-    """Process a TCX file."""
-    tree = parse(str(tcx))
-    ns = {"tcx": "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"}
-
-    trackpoints = tree.findall(".//tcx:Trackpoint", ns)
-    data = []
-    for point in trackpoints:
-        sample = {
-            TrackingColumn.TIME: point.find(".//tcx:Time", ns).text,
-            TrackingColumn.LATITUDE: _float(
-                point.find(".//tcx:LatitudeDegrees", ns).text
-            ),
-            TrackingColumn.LONGITUDE: _float(
-                point.find(".//tcx:LongitudeDegrees", ns).text
-            ),
-            TrackingColumn.ALTITUDE: _float(
-                point.find(".//tcx:AltitudeMeters", ns).text
-            ),
-            TrackingColumn.HEARTBEAT: int(
-                point.find(".//tcx:HeartRateBpm/tcx:Value", ns).text
-            ),
+def gpx_to_dataframe(gpx: TrackSource) -> pd.DataFrame:
+    """Process GPX file, given as a path or as a binary stream."""
+    times: List[Optional[str]] = []
+    lats: List[float] = []
+    lons: List[float] = []
+    alts: List[float] = []
+    for _, point in iterparse(gpx):
+        if point.tag != _GPX_TRACKPOINT:
+            continue
+        times.append(point.findtext(_GPX_TIME))
+        lats.append(_float(point.get("lat")))
+        lons.append(_float(point.get("lon")))
+        alts.append(_float(point.findtext(_GPX_ALTITUDE)))
+        point.clear()
+
+    df = _data_to_dataframe(
+        {
+            TrackingColumn.TIME: times,
+            TrackingColumn.LATITUDE: np.array(lats, dtype=np.float64),
+            TrackingColumn.LONGITUDE: np.array(lons, dtype=np.float64),
+            TrackingColumn.ALTITUDE: np.array(alts, dtype=np.float64),
         }
-        data.append(sample)
-
-    df = _data_to_dataframe(data)
+    )
     return df
 
 
-def gpx_to_dataframe(gpx: Path) -> pd.DataFrame:
-    """Process GPX file."""
-    tree = parse(str(gpx))
-    ns = {"gpx": "http://www.topografix.com/GPX/1/1"}
-
-    trackpoints = tree.findall(".//gpx:trkpt", ns)
-    data = []
-    for point in trackpoints:
-        sample = {
-            TrackingColumn.TIME: point.find(".//gpx:time", ns).text,
-            TrackingColumn.LATITUDE: _float(point.get("lat")),
-            TrackingColumn.LONGITUDE: _float(point.get("lon")),
-            TrackingColumn.ALTITUDE: _float(point.find(".//gpx:ele", ns).text),
-        }
-        data.append(sample)
-
-    df = _data_to_dataframe(data)
-    return df
+def csv_to_dataframe(track: Path) -> pd.DataFrame:
+    """Load a tracking dataframe saved as CSV."""
+    return pd.read_csv(
+        track,
+        dtype={
+            TrackingColumn.LATITUDE: np.float64,
+            TrackingColumn.LONGITUDE: np.float64,
+            TrackingColumn.ALTITUDE: np.float64,
+            TrackingColumn.HEARTBEAT: "Int64",
+        },
+        parse_dates=[TrackingColumn.TIME],
+    )
+
+
+@click.command(name="tcx-to-csv")
+@click.option(
+    "--tcx",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
+    ),
+)
+@click.option(
+    "--to",
+    type=click.Path(
+        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
+    ),
+)
+def tcx_to_csv_cmd(**kwargs: Any) -> None:
+    """TCX file to CSV dataframe."""
+    to = kwargs.pop("to")
+    df = tcx_to_dataframe(**kwargs)
+    df.to_csv(to, index=False)
+
+
+@click.command(name="gpx-to-csv")
+@click.option(
+    "--gpx",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
+    ),
+)
+@click.option(
+    "--to",
+    type=click.Path(
+        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
+    ),
+)
+def gpx_to_csv_cmd(**kwargs: Any) -> None:
+    """GPX file to CSV dataframe."""
+    to = kwargs.pop("to")
+    df = gpx_to_dataframe(**kwargs)
+    df.to_csv(to, index=False)
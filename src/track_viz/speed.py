@@ -2,19 +2,23 @@
 import json
 import os
 from pathlib import Path
+from typing import Optional
 
 import altair as alt
+import click
 import matplotlib as mpl
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import seaborn as sns
-from geopy import distance
+from matplotlib.figure import Figure
 from plotly.utils import PlotlyJSONEncoder
 
+from .input_file import csv_to_dataframe
 from .input_file import TrackingColumn
 
 mpl.use("Agg")
@@ -31,12 +35,33 @@ plt.rcParams["figure.figsize"] = (20, 10)
 
 px.set_mapbox_access_token(os.getenv("MAPBOX_TOKEN"))
 
+# Mean radius of the Earth, in meters
+EARTH_RADIUS_M = 6371008.8
+
+
+def _haversine_m(
+    lat1: npt.NDArray[np.float64],
+    lon1: npt.NDArray[np.float64],
+    lat2: npt.NDArray[np.float64],
+    lon2: npt.NDArray[np.float64],
+) -> npt.NDArray[np.float64]:
+    """Great-circle distance in meters between arrays of points given in degrees."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    delta_phi, delta_lambda = phi2 - phi1, np.radians(lon2 - lon1)
+    a = (
+        np.sin(delta_phi / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2) ** 2
+    )
+    distance: npt.NDArray[np.float64] = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    return distance
+
 
 def track_2_movements(df: pd.DataFrame) -> pd.DataFrame:
     """Transform tracking information to time series of speed and other metrics.
 
     List of fields in the movements dataframe:
     * delta_time: time difference between one sample and the previous one
+    * delta_time_s: same time difference, in seconds
     * prev_lon, prev_lat: longitude / latitude of previous tracking point
     * delta_alt_m: altitude difference in meters between current sample and previous sample
     * elapsed_time: timestamp of a tracking point, considering the run started on Jan 1 2021 at 00:00
@@ -54,84 +79,126 @@ def track_2_movements(df: pd.DataFrame) -> pd.DataFrame:
     difference is more than 2 times this sampling frequency, we mark the first point AFTER the gap with FALSE in
     field "use_point".
     """
-    movements = df.copy(deep=True)
-    movements["delta_time"] = df[TrackingColumn.TIME].diff()
-    for coord in [TrackingColumn.LONGITUDE, TrackingColumn.LATITUDE]:
-        movements[f"prev_{coord}"] = movements[coord].shift()
-    movements["delta_alt_m"] = movements[TrackingColumn.ALTITUDE].diff()
-    movements = movements.dropna()
+    # Inserting columns one by one into a dataframe is slower than computing them:
+    # the new columns are computed as arrays, then joined to the tracking data at once
+    lagged = pd.DataFrame(
+        {
+            "delta_time": df[TrackingColumn.TIME].diff(),
+            f"prev_{TrackingColumn.LONGITUDE}": df[TrackingColumn.LONGITUDE].shift(),
+            f"prev_{TrackingColumn.LATITUDE}": df[TrackingColumn.LATITUDE].shift(),
+            "delta_alt_m": df[TrackingColumn.ALTITUDE].diff(),
+        }
+    )
+    # Other columns (e.g. the heart rate) can be missing without losing the point
+    movements = pd.concat([df, lagged], axis=1).dropna(
+        subset=[
+            TrackingColumn.TIME,
+            TrackingColumn.LATITUDE,
+            TrackingColumn.LONGITUDE,
+            TrackingColumn.ALTITUDE,
+            *lagged.columns,
+        ]
+    )
 
     # only pd.timestamp  has strftime, this is a dirty trick
     # noinspection PyTypeChecker
     run_date = movements["time"].min()
-    movements["elapsed_time"] = (
+    movements.index = pd.DatetimeIndex(
         pd.Timestamp(year=run_date.year, month=run_date.month, day=run_date.day)
-        + movements["delta_time"].cumsum()
+        + movements["delta_time"].cumsum(),
+        name="elapsed_time",
     )
 
-    movements = movements.set_index("elapsed_time")
+    delta_time_s = movements["delta_time"].dt.total_seconds().to_numpy()
 
-    # geopy gives only geodesic distance
-    movements["ground_distance_m"] = movements.apply(
-        lambda x: distance.distance(
-            (x[TrackingColumn.LATITUDE], x[TrackingColumn.LONGITUDE]),
-            (
-                x[f"prev_{TrackingColumn.LATITUDE}"],
-                x[f"prev_{TrackingColumn.LONGITUDE}"],
-            ),
-        ).meters,
-        axis=1,
+    # Haversine over the whole track at once: samples are a few meters apart,
+    # the spherical approximation is well below GPS noise
+    ground_distance_m = _haversine_m(
+        movements[TrackingColumn.LATITUDE].to_numpy(),
+        movements[TrackingColumn.LONGITUDE].to_numpy(),
+        movements[f"prev_{TrackingColumn.LATITUDE}"].to_numpy(),
+        movements[f"prev_{TrackingColumn.LONGITUDE}"].to_numpy(),
     )
 
     # accounting for altitude change, using Pythagorus
-    movements["distance_m"] = (
-        movements["ground_distance_m"] ** 2 + movements["delta_alt_m"] ** 2
+    distance_m = (
+        ground_distance_m**2 + movements["delta_alt_m"].to_numpy() ** 2
     ) ** 0.5
 
-    movements["speed_ms"] = (
-        movements["distance_m"] / movements["delta_time"].dt.total_seconds()
-    )
-    movements["speed_kmh"] = movements["speed_ms"] * 3.6
-    movements["speed_moving_avg_1min"] = movements["speed_kmh"].rolling("60s").mean()
+    # Repeated timestamps give infinite or undefined speeds: both are marked as missing before the
+    # moving average and the changes in speed are computed from them, then dropped below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed_ms = distance_m / delta_time_s
+        speed_ms[~np.isfinite(speed_ms)] = np.nan
+        speed_kmh = speed_ms * 3.6
+        speed_moving_avg_1min = (
+            pd.Series(speed_kmh, index=movements.index).rolling("60s").mean().to_numpy()
+        )
 
-    movements["delta_speed_ms"] = movements["speed_ms"].diff()
-    movements["delta_moving_avg_1min"] = movements["speed_moving_avg_1min"].diff()
-    movements = movements.dropna()
+        delta_speed_ms = np.diff(speed_ms, prepend=np.nan)
+        delta_moving_avg_1min = np.diff(speed_moving_avg_1min, prepend=np.nan)
 
-    movements["acceleration_ms2"] = (
-        movements["delta_speed_ms"] / movements["delta_time"].dt.total_seconds()
+    # only the speed columns can be missing at this point: no need to scan them all
+    valid = ~(
+        np.isnan(speed_ms)
+        | np.isnan(speed_moving_avg_1min)
+        | np.isnan(delta_speed_ms)
+        | np.isnan(delta_moving_avg_1min)
     )
+    movements = movements.loc[valid]
+    columns = {
+        "delta_time_s": delta_time_s[valid],
+        "ground_distance_m": ground_distance_m[valid],
+        "distance_m": distance_m[valid],
+        "speed_ms": speed_ms[valid],
+        "speed_kmh": speed_kmh[valid],
+        "speed_moving_avg_1min": speed_moving_avg_1min[valid],
+        "delta_speed_ms": delta_speed_ms[valid],
+        "delta_moving_avg_1min": delta_moving_avg_1min[valid],
+    }
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns["acceleration_ms2"] = (
+            columns["delta_speed_ms"] / columns["delta_time_s"]
+        )
 
     # Identify missing points in the data
-    freq_s = movements["delta_time"].dt.seconds.value_counts().index[0]
-    movements["use_point"] = movements["delta_time"].dt.seconds.apply(
-        lambda x: x <= 2 * freq_s
-    )
+    seconds = columns["delta_time_s"]
+    freq_s = pd.Series(seconds).value_counts().index[0]
+    use_point = seconds <= 2 * freq_s
+    columns["use_point"] = use_point
 
-    for measure in ["speed_moving_avg_1min", TrackingColumn.ALTITUDE]:
-        movements[measure] = movements[["use_point", measure]].apply(
-            lambda x: x[measure] if x["use_point"] else np.nan, axis=1
-        )
+    columns["speed_moving_avg_1min"] = np.where(
+        use_point, columns["speed_moving_avg_1min"], np.nan
+    )
+    movements[TrackingColumn.ALTITUDE] = movements[TrackingColumn.ALTITUDE].where(
+        use_point
+    )
 
-    movements["run_distance_km"] = movements["distance_m"].cumsum() / 1000.0
-    movements["speed_minpkm"] = 60.0 / movements["speed_kmh"]
-    movements["elapsed_minutes"] = (
-        movements["time"] - movements["time"].min()
-    ).dt.total_seconds() / 60.0
+    columns["run_distance_km"] = np.cumsum(columns["distance_m"]) / 1000.0
+    with np.errstate(divide="ignore"):
+        columns["speed_minpkm"] = 60.0 / columns["speed_kmh"]
+    columns["elapsed_minutes"] = (
+        (movements["time"] - movements["time"].min()).dt.total_seconds() / 60.0
+    ).to_numpy()
 
+    movements = pd.concat(
+        [movements, pd.DataFrame(columns, index=movements.index)], axis=1
+    )
     return movements
 
 
 def plot_movement_field(movements: pd.DataFrame, mvt_field: str) -> mpl.figure.Figure:
     """Standard plot for 1 field of the movements dataframe."""
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.subplots()
     movements.plot.area(y=mvt_field, stacked=False, ax=ax)
     ax.xaxis.set_major_formatter(mdates.DateFormatter("%M:%S"))
     return fig
 
 
 def _from_track_to_plot(track: Path, mvt_field: str) -> mpl.figure.Figure:
-    df = pd.read_csv(track, parse_dates=["time"])
+    df = csv_to_dataframe(track)
     movements = track_2_movements(df)
     return plot_movement_field(movements=movements, mvt_field=mvt_field)
 
@@ -151,24 +218,33 @@ def plot_acceleration(track: Path) -> mpl.figure.Figure:
     return _from_track_to_plot(track=track, mvt_field="acceleration_ms2")
 
 
-def web_plot_speed_elevation(track: pd.DataFrame) -> mpl.figure.Figure:
-    """Create plot for website with both speed and elevation."""
-    movs = track_2_movements(track)
-    unused_points = movs.index[~movs["use_point"]]
-    unused_times = []
-    for pt in unused_points:
-        loc = movs.index.get_loc(pt)
-        unused_times.append(
-            (movs.index[loc - 1], movs.index[min(movs.shape[0] - 1, loc + 1)])
+def web_plot_speed_elevation(
+    track: pd.DataFrame, movements: Optional[pd.DataFrame] = None
+) -> mpl.figure.Figure:
+    """Create plot for website with both speed and elevation.
+
+    Pass the movements of the track if they are already computed.
+    """
+    movs = track_2_movements(track) if movements is None else movements
+    # From the point before to the point after each unusable point
+    unused_locs = np.flatnonzero(~movs["use_point"].to_numpy())
+    unused_times = list(
+        zip(
+            movs.index[np.maximum(unused_locs - 1, 0)],
+            movs.index[np.minimum(unused_locs + 1, movs.shape[0] - 1)],
         )
+    )
 
-    fig, ax = plt.subplots()
+    # Speed and elevation in the first 2 colors of the current theme
+    colors = sns.color_palette()[:2]
+    fig = Figure()
+    ax = fig.subplots()
     movs.plot.line(
         y=["speed_moving_avg_1min", "alt"],
         secondary_y=["alt"],
         ax=ax,
         linewidth=2,
-        color=[sns.color_palette()[0], sns.color_palette()[1]],
+        color=colors,
         zorder=0,
     )
     movs.plot.area(
@@ -177,7 +253,7 @@ def web_plot_speed_elevation(track: pd.DataFrame) -> mpl.figure.Figure:
         stacked=False,
         ax=ax,
         linewidth=0,
-        color=[sns.color_palette()[0], sns.color_palette()[1]],
+        color=colors,
         alpha=0.2,
         legend=False,
         zorder=1,
@@ -205,18 +281,23 @@ def web_plot_speed_elevation(track: pd.DataFrame) -> mpl.figure.Figure:
     return fig
 
 
-def web_plot_speed_climb_kde(track: pd.DataFrame) -> mpl.figure.Figure:
-    """Create plot for website for KDE with speed and elevation."""
-    movs = track_2_movements(track)
+def web_plot_speed_climb_kde(
+    track: pd.DataFrame, movements: Optional[pd.DataFrame] = None
+) -> mpl.figure.Figure:
+    """Create plot for website for KDE with speed and elevation.
+
+    Pass the movements of the track if they are already computed.
+    """
+    movs = track_2_movements(track) if movements is None else movements
     movs = movs.replace([np.inf, -np.inf], np.nan)
     movs = movs.dropna()
-    movs["climb"] = (
-        np.sign(movs["delta_alt_m"])
-        .replace(0.0, 1.0)
-        .map({1.0: "Uphill", -1.0: "Downhill"})
-        .astype("category")
+    # Flat counts as uphill
+    movs["climb"] = pd.Categorical.from_codes(
+        (movs["delta_alt_m"].to_numpy() >= 0).astype(np.int8),
+        categories=["Downhill", "Uphill"],
     )
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.subplots()
     sns.kdeplot(x="speed_kmh", fill=True, hue="climb", data=movs, cut=0, ax=ax)
     ax.grid(visible=False)
     ax.set_ylabel("")
@@ -225,16 +306,20 @@ def web_plot_speed_climb_kde(track: pd.DataFrame) -> mpl.figure.Figure:
     return fig
 
 
-def altair_plot_pace(track: pd.DataFrame) -> str:
+def altair_plot_pace(
+    track: pd.DataFrame, movements: Optional[pd.DataFrame] = None
+) -> str:
     """Prepare an altair viz for instantaneous speed and elevation.
 
+    Pass the movements of the track if they are already computed.
     Returns a Vega-Lite JSON spec file.
     """
-    movs = track_2_movements(track)
-    pct95 = movs["speed_minpkm"].describe(percentiles=[0.95])["95%"]
-    movs["speed_minpkm"] = movs["speed_minpkm"].clip(upper=pct95)
+    movs = track_2_movements(track) if movements is None else movements
+    pct95 = movs["speed_minpkm"].quantile(0.95)
 
+    # The movements may be shared with other plots: clip a copy
     source = movs[["run_distance_km", "speed_minpkm", "alt", "elapsed_minutes"]]
+    source = source.assign(speed_minpkm=source["speed_minpkm"].clip(upper=pct95))
     brush = alt.selection(type="interval", encodings=["x"], name="selector")
 
     pace = (
@@ -263,12 +348,7 @@ def altair_plot_pace(track: pd.DataFrame) -> str:
             y=alt.Y(
                 "speed_minpkm:Q",
                 title="Pace (min/km)",
-                scale=alt.Scale(
-                    domain=[
-                        0.0,
-                        source["speed_minpkm"].describe(percentiles=[0.95])["95%"],
-                    ]
-                ),
+                scale=alt.Scale(domain=[0.0, pct95]),
             ),
             tooltip=[
                 alt.Tooltip("run_distance_km", title="Distance (km)", format=".1f"),
@@ -367,12 +447,15 @@ def altair_plot_pace(track: pd.DataFrame) -> str:
     return jsondumps
 
 
-def plotly_plot_trace(track: pd.DataFrame) -> str:
+def plotly_plot_trace(
+    track: pd.DataFrame, movements: Optional[pd.DataFrame] = None
+) -> str:
     """Prepare a plot of the run with a map background.
 
+    Pass the movements of the track if they are already computed.
     Returns a Plotly JSON.
     """
-    movs = track_2_movements(track)
+    movs = track_2_movements(track) if movements is None else movements
     movs = movs.reset_index()
     movs["run_full_km"] = movs["run_distance_km"].astype(int)
     movs["diff_full_km"] = movs["run_full_km"].diff().fillna(1)
@@ -428,3 +511,41 @@ def plotly_plot_trace(track: pd.DataFrame) -> str:
 
     plot_json = json.dumps(run_trace, cls=PlotlyJSONEncoder)
     return plot_json
+
+
+@click.command(name="speed")
+@click.option(
+    "--track",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
+    ),
+)
+@click.option(
+    "--img",
+    type=click.Path(
+        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
+    ),
+)
+def speed_cmd(track: Path, img: Path) -> None:
+    """CVS dataframe to Speed plot."""
+    fig = plot_speed(track=track)
+    fig.savefig(img)
+
+
+@click.command(name="speed-moving")
+@click.option(
+    "--track",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True, path_type=Path
+    ),
+)
+@click.option(
+    "--img",
+    type=click.Path(
+        exists=False, file_okay=True, dir_okay=False, writable=True, path_type=Path
+    ),
+)
+def speed_moving_cmd(track: Path, img: Path) -> None:
+    """CVS dataframe to Speed plot."""
+    fig = plot_speed_moving_avg(track=track)
+    fig.savefig(img)
@@ -1,14 +1,13 @@
 """Run a Flask web server to create heatmap and speed graph."""
 import datetime as dt
+import gzip
 import json
 import os
-import string
 from base64 import b64encode
 from base64 import urlsafe_b64encode
 from hashlib import sha256
 from io import BytesIO
 from pathlib import Path
-from secrets import choice
 from secrets import token_hex
 from secrets import token_urlsafe
 from tempfile import gettempdir
@@ -17,7 +16,9 @@ from typing import Dict
 from typing import List
 from urllib.parse import urlencode
 
+import click
 import flask.typing as ft
+import pandas as pd
 from fitbit import ApiClient
 from fitbit import Configuration
 from fitbit.api import ActivityApi
@@ -26,14 +27,16 @@ from flask import Flask
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import Response
 from flask import session
-from werkzeug.utils import secure_filename
 
 from .heatmap import heatmap_from_dataframe
 from .input_file import gpx_to_dataframe
 from .input_file import tcx_to_dataframe
+from .input_file import TrackSource
 from .speed import altair_plot_pace
 from .speed import plotly_plot_trace
+from .speed import track_2_movements
 
 
 app = Flask(__name__)
@@ -42,49 +45,70 @@ ALLOWED_EXTENSIONS = {".tcx", ".gpx"}
 app.config["MAX_CONTENT_LENGTH"] = 4 * 1024 * 1024  # 4MB
 app.config["UPLOAD_FOLDER"] = gettempdir()
 
-UNRESERVED = string.ascii_letters + string.digits + "-._~"
+COMPRESSED_MIMETYPES = {"text/html", "application/json"}
 
 
 def _allowed_file(filename: str) -> bool:
     return Path(filename).suffix in ALLOWED_EXTENSIONS
 
 
+def _read_track(source: TrackSource, suffix: str) -> pd.DataFrame:
+    if suffix == ".tcx":
+        return tcx_to_dataframe(tcx=source)
+    elif suffix == ".gpx":
+        return gpx_to_dataframe(gpx=source)
+    else:
+        raise ValueError(f"Wrong suffix {suffix}, expected one of {ALLOWED_EXTENSIONS}")
+
+
+def _read_session_track() -> pd.DataFrame:
+    # The file downloaded from Fitbit is only needed once, delete it even if it cannot be read
+    fpath = Path(session.pop("tcx_file"))
+    session.modified = True
+    try:
+        return _read_track(source=fpath, suffix=fpath.suffix)
+    finally:
+        fpath.unlink(missing_ok=True)
+
+
+@app.after_request
+def _compress(response: Response) -> Response:
+    """Gzip the pages, the speed page embeds large JSON specs."""
+    if (
+        "gzip" not in request.headers.get("Accept-Encoding", "")
+        or response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSED_MIMETYPES
+    ):
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
 @app.route("/heatmap", methods=["GET", "POST"])
 def create_heatmap() -> ft.ResponseReturnValue:
     """Handles incoming activity file and create heatmap."""
     if request.method == "POST" or "tcx_file" in session:
         if "tcx_file" in session:
-            fpath = Path(session.pop("tcx_file"))
-            session.modified = True
+            track = _read_session_track()
         else:
             f = request.files["file"]
 
             if f.filename is None or not _allowed_file(f.filename):
                 return redirect(request.url)
 
-            fpath = (
-                Path(app.config["UPLOAD_FOLDER"])
-                / f"{token_hex(8)}_{secure_filename(f.filename)}"
-            )
-            f.save(fpath)
-
-        suffix = fpath.suffix
-        if suffix == ".tcx":
-            track = tcx_to_dataframe(tcx=fpath)
-        elif suffix == ".gpx":
-            track = gpx_to_dataframe(gpx=fpath)
-        else:
-            raise ValueError(
-                f"Wrong suffix {suffix}, expected one of {app.config['ALLOWED_EXTENSIONS']}"
-            )
+            # parse the upload as it comes, no need to save it first
+            track = _read_track(source=f.stream, suffix=Path(f.filename).suffix)
 
         fig = heatmap_from_dataframe(track=track)
         img_bytes = BytesIO()
         fig.savefig(img_bytes, format="jpg")
         img_b64bytes = b64encode(img_bytes.getvalue()).decode("utf-8")
 
-        fpath.unlink()
-
         return render_template("show_heatmap.html", img_data=img_b64bytes)
     else:
         return render_template("upload_heatmap.html")
@@ -95,34 +119,19 @@ def create_speed_plots() -> ft.ResponseReturnValue:
     """Handles incoming activity file and create speed graph."""
     if request.method == "POST" or "tcx_file" in session:
         if "tcx_file" in session:
-            fpath = Path(session.pop("tcx_file"))
-            session.modified = True
+            track = _read_session_track()
         else:
             f = request.files["file"]
 
             if f.filename is None or not _allowed_file(f.filename):
                 return redirect(request.url)
 
-            fpath = (
-                Path(app.config["UPLOAD_FOLDER"])
-                / f"{token_hex(8)}_{secure_filename(f.filename)}"
-            )
-            f.save(fpath)
-
-        suffix = fpath.suffix
-        if suffix == ".tcx":
-            track = tcx_to_dataframe(tcx=fpath)
-        elif suffix == ".gpx":
-            track = gpx_to_dataframe(gpx=fpath)
-        else:
-            raise ValueError(
-                f"Wrong suffix {suffix}, expected one of {app.config['ALLOWED_EXTENSIONS']}"
-            )
-
-        specjson = altair_plot_pace(track=track)
-        fpath.unlink()
+            # parse the upload as it comes, no need to save it first
+            track = _read_track(source=f.stream, suffix=Path(f.filename).suffix)
 
-        mapjson = plotly_plot_trace(track=track)
+        movements = track_2_movements(track)
+        specjson = altair_plot_pace(track=track, movements=movements)
+        mapjson = plotly_plot_trace(track=track, movements=movements)
 
         return render_template(
             "show_graph.html",
@@ -136,7 +145,8 @@ def create_speed_plots() -> ft.ResponseReturnValue:
 @app.route("/fitbitauthorize", methods=["GET"])
 def fitbit_authorize() -> ft.ResponseReturnValue:
     """Get Authorization from Fitbit."""
-    code_verifier = "".join(choice(UNRESERVED) for _ in range(64))
+    # 48 random bytes => 64 characters of the URL-safe alphabet, all unreserved (RFC 7636)
+    code_verifier = token_urlsafe(48)
     code_challenge = urlsafe_b64encode(
         sha256(code_verifier.encode("utf-8")).digest()
     ).decode("utf-8")[:-1]
@@ -277,6 +287,30 @@ def fitbit_loadrun() -> ft.ResponseReturnValue:
 #     )
 
 
-def run_webserver(host: str, port: int) -> None:
-    """Run webserver."""
-    app.run(host=host, port=port, debug=False)
+def run_webserver(host: str, port: int, processes: int = 1) -> None:
+    """Run webserver.
+
+    Requests are handled in threads. Rendering the plots is CPU-bound and holds the GIL,
+    so with ``processes`` > 1 each request is handled in a forked process instead.
+    """
+    app.run(
+        host=host,
+        port=port,
+        debug=False,
+        threaded=processes == 1,
+        processes=processes,
+    )
+
+
+@click.command(name="flask")
+@click.option("--host", type=str, default="127.0.0.1")
+@click.option("--port", type=int, default=5000)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Handle requests in up to this many forked processes.",
+)
+def flask_cmd(**kwargs: Any) -> None:
+    """Have a web server GUI."""
+    run_webserver(**kwargs)
@@ -0,0 +1,157 @@
+"""Test cases for the heatmap module."""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+from typing import List
+from urllib.error import HTTPError
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from track_viz.heatmap import _binned_kde
+from track_viz.heatmap import _download_background
+from track_viz.heatmap import _load_background
+
+
+def test_binned_kde() -> None:
+    """It matches the kernel density evaluated point by point."""
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=500)
+    y = x + rng.normal(scale=0.3, size=500)
+    kde = _binned_kde(x, y)
+    assert kde is not None
+    x_centers, y_centers, density = kde
+
+    # A point without a position is left out
+    with_missing = _binned_kde(np.append(x, np.nan), np.append(y, 0.0))
+    assert with_missing is not None
+    np.testing.assert_array_equal(with_missing[2], density)
+
+    covariance = np.cov(x, y) * len(x) ** (-1 / 3)
+    inv = np.linalg.inv(covariance)
+    gx, gy = np.meshgrid(x_centers, y_centers, indexing="ij")
+    dx, dy = gx[..., None] - x, gy[..., None] - y
+    expected = np.exp(
+        -0.5 * (inv[0, 0] * dx**2 + 2 * inv[0, 1] * dx * dy + inv[1, 1] * dy**2)
+    ).sum(axis=-1)
+
+    assert density.shape == expected.shape
+    assert np.abs(density / density.max() - expected / expected.max()).max() < 0.05
+
+
+def test_binned_kde_degenerate() -> None:
+    """It gives no density when the points are constant, on a line or missing."""
+    x = np.linspace(0.0, 100.0, 300)
+    assert _binned_kde(x, 0.37 * x + 3) is None
+    assert _binned_kde(np.full(300, 5.0), np.full(300, 7.0)) is None
+    assert _binned_kde(x[:1], x[:1]) is None
+    assert _binned_kde(np.append(x[:1], np.nan), np.append(x[:1], 1.0)) is None
+
+
+class _Response:
+    """Stand-in for the Mapbox API, records the URLs and returns a fixed body."""
+
+    calls: List[str] = []
+    body = b"jpeg"
+
+    def __init__(self, url: str) -> None:
+        self.calls.append(url)
+
+    def __enter__(self) -> "_Response":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def read(self) -> bytes:
+        return self.body
+
+
+@pytest.fixture
+def mapbox(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Route the downloads to _Response and the cache to a temporary directory."""
+    heatmap_module = sys.modules["track_viz.heatmap"]
+    monkeypatch.setattr(_Response, "calls", [])
+    monkeypatch.setattr(heatmap_module, "urlopen", _Response)
+    monkeypatch.setattr(heatmap_module, "MAPBOX_CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+def test_download_background_cached(mapbox: Path) -> None:
+    """It downloads an image once, then reads it from the disk cache."""
+    assert _download_background("https://mapbox/a") == b"jpeg"
+    assert _download_background("https://mapbox/a") == b"jpeg"
+    assert _download_background("https://mapbox/b") == b"jpeg"
+    assert _Response.calls == ["https://mapbox/a", "https://mapbox/b"]
+    assert len(list(mapbox.iterdir())) == 2
+
+
+def test_download_background_evicts(
+    mapbox: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """It keeps the most recently used images only."""
+    monkeypatch.setattr(sys.modules["track_viz.heatmap"], "MAPBOX_CACHE_SIZE", 2)
+    _download_background("https://mapbox/a")
+    (oldest,) = mapbox.iterdir()
+    os.utime(oldest, (0, 0))
+    _download_background("https://mapbox/b")
+    _download_background("https://mapbox/c")
+    assert len(list(mapbox.iterdir())) == 2
+    assert not oldest.exists()
+
+    _download_background("https://mapbox/a")
+    assert _Response.calls[-1] == "https://mapbox/a"
+
+
+def test_load_background_replaces_broken_cache(
+    mapbox: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """It downloads the image again when the cached file cannot be decoded."""
+    image = BytesIO()
+    plt.imsave(image, np.zeros((8, 8, 3), dtype=np.uint8), format="jpg")
+    monkeypatch.setattr(_Response, "body", image.getvalue())
+
+    url = "https://mapbox/broken"
+    _download_background(url)
+    (cached,) = mapbox.iterdir()
+    cached.write_bytes(b"not a jpeg")
+
+    assert _load_background(url).shape == (8, 8, 3)
+    assert _Response.calls == [url, url]
+    assert cached.read_bytes() == image.getvalue()
+
+
+def test_load_background_does_not_retry_downloads(
+    mapbox: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """It calls Mapbox once when a download fails or cannot be decoded."""
+    with pytest.raises((OSError, ValueError)):
+        _load_background("https://mapbox/not-an-image")
+    assert _Response.calls == ["https://mapbox/not-an-image"]
+
+    def _unauthorized(url: str) -> None:
+        _Response.calls.append(url)
+        raise HTTPError(url, 401, "Unauthorized", Message(), None)
+
+    monkeypatch.setattr(sys.modules["track_viz.heatmap"], "urlopen", _unauthorized)
+    with pytest.raises(HTTPError):
+        _load_background("https://mapbox/bad-token")
+    assert _Response.calls[1:] == ["https://mapbox/bad-token"]
+
+
+def test_download_background_threads(mapbox: Path) -> None:
+    """It stores one complete image when threads download the same URL."""
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        bodies = list(
+            pool.map(
+                lambda _: _download_background("https://mapbox/a", refresh=True),
+                range(32),
+            )
+        )
+    assert bodies == [b"jpeg"] * 32
+    assert [f.read_bytes() for f in mapbox.iterdir()] == [b"jpeg"]
@@ -1,8 +1,16 @@
 """Test cases for the __main__ module."""
+import re
+from io import BytesIO
 from pathlib import Path
+from typing import List
+from typing import Optional
 
+import pandas as pd
+
+from track_viz import csv_to_dataframe
 from track_viz import gpx_to_dataframe
 from track_viz import tcx_to_dataframe
+from track_viz.input_file import _to_datetime
 
 
 def test_gpx() -> None:
@@ -15,3 +23,39 @@ def test_tcx() -> None:
     """It exits with a status code of zero."""
     df = tcx_to_dataframe(Path("tests/sample_tcx.tcx"))
     assert df.shape[0] == 4
+
+
+def test_tcx_stream() -> None:
+    """It reads an opened file like its path."""
+    with open("tests/sample_tcx.tcx", "rb") as tcx:
+        df = tcx_to_dataframe(tcx)
+    pd.testing.assert_frame_equal(df, tcx_to_dataframe(Path("tests/sample_tcx.tcx")))
+
+
+def test_tcx_missing_heart_rate(tmp_path: Path) -> None:
+    """It leaves the heart rate missing when a trackpoint has none."""
+    tcx = Path("tests/sample_tcx.tcx").read_bytes()
+    tcx = re.sub(rb"<HeartRateBpm>.*?</HeartRateBpm>", b"", tcx, count=1, flags=re.S)
+    df = tcx_to_dataframe(BytesIO(tcx))
+    assert df["bpm"].isna().tolist() == [True, False, False, False]
+
+    df.to_csv(tmp_path / "track.csv", index=False)
+    pd.testing.assert_frame_equal(csv_to_dataframe(tmp_path / "track.csv"), df)
+
+
+def test_csv_round_trip(tmp_path: Path) -> None:
+    """It reads back the CSV written by tcx-to-csv."""
+    df = tcx_to_dataframe(Path("tests/sample_tcx.tcx"))
+    df.to_csv(tmp_path / "track.csv", index=False)
+    pd.testing.assert_frame_equal(csv_to_dataframe(tmp_path / "track.csv"), df)
+
+
+def test_to_datetime_with_offset() -> None:
+    """It parses local timestamps like pandas does."""
+    cases: List[List[Optional[str]]] = [
+        ["2021-11-20T10:03:56.000+01:00", "2021-11-20T10:03:59.500+01:00"],
+        ["2021-03-28T01:59:59+01:00", "2021-03-28T03:00:00+02:00"],
+        ["2021-10-31T10:58:34.000Z", None],
+    ]
+    for times in cases:
+        pd.testing.assert_index_equal(_to_datetime(times), pd.to_datetime(times))
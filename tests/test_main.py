@@ -1,8 +1,13 @@
 """Test cases for the __main__ module."""
+import subprocess  # noqa: S404
+import sys
+
+import click
 import pytest
 from click.testing import CliRunner
 
 from track_viz import main
+from track_viz.__main__ import LazyGroup
 
 
 @pytest.fixture
@@ -31,3 +36,58 @@ def test_gpx(runner: CliRunner) -> None:
         main, ["gpx-to-csv", "--gpx", "tests/sample_gpx.gpx", "--to", "/dev/null"]
     )
     assert result.exit_code == 0
+
+
+def test_help_lists_lazy_commands(runner: CliRunner) -> None:
+    """It lists every subcommand without importing it."""
+    result = runner.invoke(main, ["--help"])
+    assert result.exit_code == 0
+    for command in ["flask", "gpx-to-csv", "heatmap", "speed", "tcx-to-csv"]:
+        assert command in result.output
+
+
+def test_help_lists_eager_commands(runner: CliRunner) -> None:
+    """It lists the commands registered on the group too."""
+    group = LazyGroup()
+
+    @group.command()
+    def hello() -> None:
+        """Say hello."""
+
+    result = runner.invoke(group, ["--help"])
+    assert result.exit_code == 0
+    assert ["hello", "Say", "hello."] in [
+        line.split() for line in result.output.splitlines()
+    ]
+    assert "tcx-to-csv" in result.output
+
+
+def test_lazy_short_help(runner: CliRunner) -> None:
+    """It shows the short help of the actual commands."""
+    ctx = click.Context(main)
+    for name, (_, _, short_help) in LazyGroup.lazy_subcommands.items():
+        command = main.get_command(ctx, name)
+        assert command is not None
+        assert command.get_short_help_str() == short_help
+
+
+def test_cli_help_is_light() -> None:
+    """It does not import the plotting stack to show the help."""
+    code = (
+        "import sys, track_viz.__main__; "
+        "track_viz.__main__.main(['--help'], standalone_mode=False); "
+        "heavy = {'pandas', 'matplotlib', 'seaborn', 'flask'} & set(sys.modules); "
+        "sys.exit(len(heavy))"
+    )
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0  # noqa: S603
+
+
+def test_package_dir_lists_public_names() -> None:
+    """It lists every public name before importing the plotting stack."""
+    code = (
+        "import sys, track_viz; "
+        "missing = set(track_viz.__all__) - set(dir(track_viz)); "
+        "heavy = {'pandas', 'matplotlib', 'seaborn', 'flask'} & set(sys.modules); "
+        "sys.exit(len(missing) + len(heavy))"
+    )
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0  # noqa: S603
@@ -0,0 +1,113 @@
+"""Test cases for the speed module."""
+import re
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from track_viz import tcx_to_dataframe
+from track_viz import track_2_movements
+from track_viz.speed import _haversine_m
+from track_viz.speed import altair_plot_pace
+from track_viz.speed import plotly_plot_trace
+
+
+def test_haversine() -> None:
+    """One degree of latitude is about 111.2 km."""
+    distance = _haversine_m(
+        np.array([0.0, 52.0]),
+        np.array([4.0, 4.0]),
+        np.array([1.0, 52.0]),
+        np.array([4.0, 4.0]),
+    )
+    assert distance == pytest.approx([111_195.1, 0.0], abs=0.1)
+
+
+def test_track_2_movements() -> None:
+    """It computes one movement per usable sample."""
+    movements = track_2_movements(tcx_to_dataframe(Path("tests/sample_tcx.tcx")))
+    assert movements.shape[0] == 2
+    assert (movements["distance_m"] >= movements["ground_distance_m"]).all()
+
+
+def test_track_2_movements_keeps_input() -> None:
+    """It does not modify the tracking dataframe."""
+    track = tcx_to_dataframe(Path("tests/sample_tcx.tcx"))
+    before = track.copy()
+    track_2_movements(track)
+    pd.testing.assert_frame_equal(track, before)
+
+
+@pytest.mark.parametrize("step", [2, 1])
+def test_track_2_movements_missing_heart_rate(step: int) -> None:
+    """It keeps the points without a heart rate."""
+    tcx = Path("tests/sample_tcx.tcx").read_bytes()
+    full = track_2_movements(tcx_to_dataframe(BytesIO(tcx)))
+    # Remove the heart rate of every other trackpoint, then of all of them
+    heart_rates = re.split(rb"(?s)(<HeartRateBpm>.*?</HeartRateBpm>)", tcx)
+    for i in range(1, len(heart_rates), 2 * step):
+        heart_rates[i] = b""
+    movements = track_2_movements(tcx_to_dataframe(BytesIO(b"".join(heart_rates))))
+    assert movements["bpm"].isna().any()
+    pd.testing.assert_frame_equal(
+        movements.drop(columns="bpm"), full.drop(columns="bpm")
+    )
+
+
+def test_track_2_movements_day_long_gap() -> None:
+    """It flags a point recorded more than a day after the previous one."""
+    times = pd.date_range("2021-11-20 10:00", periods=10, freq="s").append(
+        pd.DatetimeIndex(["2021-11-21 10:00:10"])
+    )
+    track = pd.DataFrame(
+        {
+            "time": times,
+            "lat": np.linspace(52.0, 52.001, len(times)),
+            "lon": np.full(len(times), 4.0),
+            "alt": np.zeros(len(times)),
+        }
+    )
+    movements = track_2_movements(track)
+    assert movements["use_point"].tolist() == [True] * 8 + [False]
+
+
+def test_track_2_movements_repeated_timestamp() -> None:
+    """It drops the infinite speed of a point recorded twice at the same time."""
+    times = pd.date_range("2021-11-20 10:00", periods=10, freq="s")
+    track = pd.DataFrame(
+        {
+            "time": times.insert(5, times[4]),
+            "lat": np.linspace(52.0, 52.001, len(times) + 1),
+            "lon": np.full(len(times) + 1, 4.0),
+            "alt": np.zeros(len(times) + 1),
+        }
+    )
+    movements = track_2_movements(track)
+    speeds = movements[
+        ["speed_ms", "speed_moving_avg_1min", "acceleration_ms2", "speed_minpkm"]
+    ]
+    assert np.isfinite(speeds.to_numpy()).all()
+
+
+def test_track_2_movements_is_vectorized(monkeypatch: pytest.MonkeyPatch) -> None:
+    """It does not fall back to row-wise apply."""
+
+    def _no_apply(*args: Any, **kwargs: Any) -> None:
+        raise AssertionError("apply() called")
+
+    monkeypatch.setattr(pd.DataFrame, "apply", _no_apply)
+    monkeypatch.setattr(pd.Series, "apply", _no_apply)
+    track_2_movements(tcx_to_dataframe(Path("tests/sample_tcx.tcx")))
+
+
+def test_web_plots_share_movements() -> None:
+    """The web plots do not modify the movements they are given."""
+    track = tcx_to_dataframe(Path("tests/sample_tcx.tcx"))
+    movements = track_2_movements(track)
+    before = movements.copy()
+    assert altair_plot_pace(track, movements=movements) == altair_plot_pace(track)
+    plotly_plot_trace(track, movements=movements)
+    pd.testing.assert_frame_equal(movements, before)